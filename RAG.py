@@ -1,49 +1,181 @@
+import hashlib
+import json
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import queue
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_nomic import NomicEmbeddings
+from langchain_core.documents import Document
 from langchain_qdrant import QdrantVectorStore
 from langchain_community.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationTokenBufferMemory
+from langchain_core.callbacks import BaseCallbackHandler
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
-from uuid import uuid4
+from qdrant_client.http.models import PointStruct
 
-class RAGSystem:
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Optional: fall back to the pure-Python pypdf loader
+    pdfium = None
+
+from embedding_cache import EmbeddingCache
+from embeddings import embedding_backend, get_embedding_model
+from qdrant_collection import chunk_id, create_documents_collection
+from retrievers import CachingRetriever, QdrantQueryRetriever
+from text_splitter import split_documents
+
+# Chunks per embedding request and number of requests kept in flight
+EMBEDDING_BATCH_SIZE = 128
+EMBEDDING_WORKERS = 16
+
+# Chunked documents from earlier runs, keyed by file content and chunk settings
+CHUNK_CACHE_DIR = "./.chunk_cache"
+
+# Chunk settings used by the indexing workflow; part of the chunk cache key
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+# Connection and embedding client shared by every RAGSystem in the process
+_shared_client = None
+_shared_embedding_model = None
+_shared_lock = threading.Lock()
+
+def get_qdrant_client():
+    """Return the process-wide Qdrant client, connecting on first use"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            # gRPC (protobuf over HTTP/2) instead of REST/JSON; QDRANT_URL
+            # names the host, the gRPC port defaults to Qdrant's 6334
+            qdrant_url = urlparse(os.getenv("QDRANT_URL", "http://localhost:6333"))
+            _shared_client = QdrantClient(
+                host=qdrant_url.hostname,
+                grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+                prefer_grpc=True
+            )
+        return _shared_client
+
+def get_shared_embedding_model(nomic_api_key=None):
+    """Return the process-wide embedding model, creating it on first use"""
+    global _shared_embedding_model
+    with _shared_lock:
+        if _shared_embedding_model is None:
+            _shared_embedding_model = get_embedding_model(nomic_api_key)
+        return _shared_embedding_model
+
+def _load_pdf_fast(file_path):
+    """Extract PDF text page by page with PDFium (native code)"""
+    pdf = pdfium.PdfDocument(file_path)
+    pages = []
+    
+    try:
+        for page_number, page in enumerate(pdf):
+            textpage = page.get_textpage()
+            pages.append(Document(
+                page_content=textpage.get_text_range(),
+                metadata={"source": file_path, "page": page_number}
+            ))
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    
+    return pages
+
+def _load_one(file_path):
+    """Load a single PDF or TXT file into a list of documents"""
+    file_name = os.path.basename(file_path)
+    
+    if file_name.lower().endswith(".pdf"):
+        print(f"Loading PDF: {file_name}")
+        if pdfium is not None:
+            try:
+                return _load_pdf_fast(file_path)
+            except Exception as e:
+                print(f"PDFium failed on {file_name}, falling back to pypdf: {e}")
+        
+        try:
+            loader = PyPDFLoader(file_path)
+            # One page per document; chunk_documents does the only split
+            return loader.load()
+        except Exception as e:
+            print(f"Error loading PDF {file_name}: {e}")
+            
+    elif file_name.lower().endswith(".txt"):
+        print(f"Loading TXT: {file_name}")
+        try:
+            loader = TextLoader(file_path, encoding='utf-8')
+            return loader.load()
+        except Exception as e:
+            print(f"Error loading TXT {file_name}: {e}")
+    else:
+        print(f"Skipping unsupported file: {file_name}")
+    
+    return []
+
+def _chunk_cache_path(file_path, chunk_size, chunk_overlap):
+    """Return the chunk cache file for a source file, or None if it can't be read"""
+    try:
+        # Hash in 1 MB blocks so large PDFs are never read into memory whole
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(block)
+        file_hash = file_hash.hexdigest()
+    except OSError:
+        return None
+    
+    return os.path.join(CHUNK_CACHE_DIR, f"{file_hash}-{chunk_size}-{chunk_overlap}.json")
+
+class _TokenQueueHandler(BaseCallbackHandler):
+    """Callback handler that puts streamed LLM tokens on a queue"""
+    
     def __init__(self):
+        self.tokens = queue.Queue()
+    
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.put(token)
+
+class RAGSystem:
+    def __init__(self, client=None, embedding_model=None):
         # Load environment variables
         load_dotenv()
         
-        # Initialize variables
-        self.client = None
+        # Initialize variables - client and embedding model can be injected,
+        # otherwise the process-wide shared instances are used
+        self.client = client
         self.collection_name = "bank_documents"
-        self.embedding_model = None
+        self.embedding_model = embedding_model
         self.vector_store = None
+        self.retriever = None
         self.qa_chain = None
+        self.qa_chain_without_sources = None
         self.memory = None
         
         # Validate API keys
         self.openai_key = os.getenv("OPENAI_API_KEY")
         self.nomic_api_key = os.getenv("NOMIC_API_KEY")
         
-        if not self.openai_key or not self.nomic_api_key:
+        # The Nomic key is only needed when embedding through the cloud API
+        if not self.openai_key or (not self.nomic_api_key and embedding_backend() != "local"):
             raise ValueError("Missing API keys in environment variables. Please check your .env file.")
     
     def initialize_embedding_model(self):
-        """Initialize the Nomic embedding model"""
-        self.embedding_model = NomicEmbeddings(
-            model="nomic-embed-text-v1.5",
-            nomic_api_key=self.nomic_api_key
-        )
+        """Initialize the embedding model (Nomic API or local, see EMBED_BACKEND)"""
+        if self.embedding_model is None:
+            self.embedding_model = get_shared_embedding_model(self.nomic_api_key)
         return self.embedding_model
     
     def connect_qdrant(self):
         """Connect to Qdrant and create collection if needed"""
-        self.client = QdrantClient(url="http://localhost:6333")
+        if self.client is None:
+            self.client = get_qdrant_client()
         
         # Create collection if it doesn't exist
         try:
@@ -51,15 +183,16 @@ class RAGSystem:
             print(f"Collection '{self.collection_name}' already exists.")
         except Exception:
             print(f"Creating collection '{self.collection_name}'...")
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(size=768, distance=Distance.COSINE)
-            )
+            create_documents_collection(self.client, self.collection_name)
         
         return self.client
     
     def select_files(self):
         """Use tkinter file dialog to select PDF and TXT files"""
+        # Imported here so loader worker processes never pull in GUI state
+        import tkinter as tk
+        from tkinter import filedialog
+        
         root = tk.Tk()
         root.withdraw()  # Hide the main window
         
@@ -84,46 +217,76 @@ class RAGSystem:
         
         return list(selected_files)
     
-    def load_documents_from_files(self, file_paths):
-        """Load documents from selected file paths"""
-        all_docs = []
-        
-        for file_path in file_paths:
-            file_name = os.path.basename(file_path)
-            
-            if file_name.lower().endswith(".pdf"):
-                print(f"Loading PDF: {file_name}")
-                try:
-                    loader = PyPDFLoader(file_path)
-                    pages = loader.load_and_split()
-                    all_docs.extend(pages)
-                except Exception as e:
-                    print(f"Error loading PDF {file_name}: {e}")
-                    
-            elif file_name.lower().endswith(".txt"):
-                print(f"Loading TXT: {file_name}")
-                try:
-                    loader = TextLoader(file_path, encoding='utf-8')
-                    documents = loader.load()
-                    all_docs.extend(documents)
-                except Exception as e:
-                    print(f"Error loading TXT {file_name}: {e}")
-            else:
-                print(f"Skipping unsupported file: {file_name}")
+    def load_documents_from_files(self, file_paths, max_workers=None):
+        """Load documents from selected file paths, one worker process per file"""
+        # Parsing is CPU-bound and every file is independent, so spread the
+        # files across cores; a single file isn't worth the process start-up
+        if len(file_paths) <= 1:
+            results = [_load_one(file_path) for file_path in file_paths]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_load_one, file_paths))
         
+        all_docs = list(chain.from_iterable(results))
         return all_docs
     
-    def chunk_documents(self, documents, chunk_size=500, chunk_overlap=50):
+    def chunk_documents(self, documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
         """Split documents into chunks"""
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", " "]
-        )
-        
-        chunks = splitter.split_documents(documents)
+        chunks = split_documents(documents, chunk_size, chunk_overlap)
         return chunks
     
+    def load_cached_chunks(self, cache_paths):
+        """Return cached chunks and the files that still need loading"""
+        cached_chunks = []
+        uncached_files = []
+        
+        for file_path, cache_path in cache_paths.items():
+            if cache_path and os.path.exists(cache_path):
+                try:
+                    with open(cache_path, encoding="utf-8") as f:
+                        chunks = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    # Unreadable cache file: load the source again and rewrite it
+                    print(f"Ignoring chunk cache for {os.path.basename(file_path)}: {e}")
+                else:
+                    print(f"Using cached chunks: {os.path.basename(file_path)}")
+                    # The cache is keyed by content, so the same bytes may have
+                    # been cached under another path; cite the file as selected now
+                    for chunk in chunks:
+                        chunk["metadata"]["source"] = file_path
+                        cached_chunks.append(Document(**chunk))
+                    continue
+            
+            uncached_files.append(file_path)
+        
+        return cached_chunks, uncached_files
+    
+    def cache_chunks(self, chunks, cache_paths):
+        """Write freshly created chunks to the cache, one file per source"""
+        by_source = {}
+        for chunk in chunks:
+            by_source.setdefault(chunk.metadata.get("source"), []).append({
+                "page_content": chunk.page_content,
+                "metadata": chunk.metadata
+            })
+        
+        os.makedirs(CHUNK_CACHE_DIR, exist_ok=True)
+        for file_path, cache_path in cache_paths.items():
+            # Files that failed to load are retried next time, not cached as empty
+            if cache_path and file_path in by_source:
+                # Write to a temp file and rename it into place, so an
+                # interrupted run never leaves a truncated cache file behind
+                with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=CHUNK_CACHE_DIR, suffix=".tmp", delete=False
+                ) as f:
+                    try:
+                        json.dump(by_source[file_path], f)
+                    except BaseException:
+                        f.close()
+                        os.remove(f.name)
+                        raise
+                os.replace(f.name, cache_path)
+    
     def index_documents(self, chunks):
         """Index and store chunks in Qdrant"""
         if not self.embedding_model:
@@ -134,29 +297,129 @@ class RAGSystem:
         
         texts = []
         metadatas = []
+        seen = set()
         
         for chunk in chunks:
+            # Boilerplate headers/footers and re-selected files repeat the same
+            # text; embed each distinct chunk only once
+            point_id = chunk_id(chunk.page_content)
+            if point_id in seen:
+                continue
+            seen.add(point_id)
+            
             texts.append(chunk.page_content)
             
             metadata = {
                 "source": chunk.metadata.get("source", ""),
                 "page": chunk.metadata.get("page", -1),
-                "chunk_id": str(uuid4())
+                "chunk_id": point_id
             }
             
             metadatas.append(metadata)
         
-        print("Generating embeddings...")
+        if len(texts) < len(chunks):
+            print(f"Skipped {len(chunks) - len(texts)} duplicate chunks")
+        
+        # Points are uploaded with their precomputed vectors; the
+        # QdrantVectorStore wrapper is only needed on the read path
+        print("Generating embeddings and uploading to Qdrant...")
+        # At most 4 embedded batches wait for upload, plus the EMBEDDING_WORKERS
+        # batches the producer keeps submitted to the embedding pool
+        point_batches = queue.Queue(maxsize=4)
+        producer_errors = []
+        stop = threading.Event()
+        
+        def produce():
+            """Embed batches on the thread pool and queue them for upload"""
+            cache = None
+            try:
+                # Chunks embedded by an earlier run are read back from the cache
+                cache = EmbeddingCache(self.embedding_model.model)
+                
+                def embed(batch):
+                    return cache.embed(batch, self.embedding_model.embed_documents)
+                
+                starts = iter(range(0, len(texts), EMBEDDING_BATCH_SIZE))
+                pending = deque()
+                executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS)
+                
+                def submit_next():
+                    start = next(starts, None)
+                    if start is not None:
+                        batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+                        pending.append((start, executor.submit(embed, batch)))
+                
+                try:
+                    # Only EMBEDDING_WORKERS batches are submitted ahead of the
+                    # upload queue; the next one goes in as each result is taken
+                    for _ in range(EMBEDDING_WORKERS):
+                        submit_next()
+                    
+                    while pending:
+                        # The upload failed; don't embed batches nobody will upload
+                        if stop.is_set():
+                            break
+                        
+                        start, future = pending.popleft()
+                        vectors = future.result()
+                        submit_next()
+                        end = start + EMBEDDING_BATCH_SIZE
+                        
+                        # Payload layout matches what QdrantVectorStore reads back
+                        point_batches.put([
+                            PointStruct(
+                                id=metadata["chunk_id"],
+                                vector=vector,
+                                payload={
+                                    QdrantVectorStore.CONTENT_KEY: text,
+                                    QdrantVectorStore.METADATA_KEY: metadata
+                                }
+                            )
+                            for text, metadata, vector in zip(texts[start:end], metadatas[start:end], vectors)
+                        ])
+                finally:
+                    # A failed embed or upload drops every batch not yet started
+                    executor.shutdown(cancel_futures=True)
+            except Exception as e:
+                producer_errors.append(e)
+            finally:
+                if cache:
+                    cache.close()
+                point_batches.put(None)
         
-        # Create vector store
-        self.vector_store = QdrantVectorStore(
-            client=self.client,
-            collection_name=self.collection_name,
-            embedding=self.embedding_model
-        )
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        
+        # Upload each batch while the producer is still embedding the next ones
+        uploaded = False
+        try:
+            while True:
+                points = point_batches.get()
+                if points is None:
+                    break
+                
+                self.client.upload_points(
+                    collection_name=self.collection_name,
+                    points=points,
+                    batch_size=EMBEDDING_BATCH_SIZE,
+                    wait=False
+                )
+            uploaded = True
+        finally:
+            if not uploaded:
+                # Stop the producer and drain the queue so it never blocks on put()
+                stop.set()
+                while point_batches.get() is not None:
+                    pass
+            producer.join()
+        
+        if producer_errors:
+            raise producer_errors[0]
+        
+        # Cached search results may no longer be the best matches
+        if self.retriever:
+            self.retriever.clear()
         
-        print("Uploading to Qdrant...")
-        self.vector_store.add_texts(texts=texts, metadatas=metadatas)
         print(f"✅ Indexed {len(texts)} chunks into Qdrant.")
     
     def initialize_qa_system(self):
@@ -174,59 +437,90 @@ class RAGSystem:
             embedding=self.embedding_model
         )
         
-        # Initialize LLM
+        # Initialize LLM - the answer is streamed token by token, the
+        # follow-up question rewrite is not shown so it doesn't need to be
         llm = ChatOpenAI(
+            openai_api_key=self.openai_key,
+            model_name="gpt-4",
+            temperature=0.2,
+            streaming=True
+        )
+        condense_question_llm = ChatOpenAI(
             openai_api_key=self.openai_key,
             model_name="gpt-4",
             temperature=0.2
         )
         
-        # Initialize memory with output key specified
-        self.memory = ConversationBufferMemory(
+        # Initialize memory with output key specified; only the most recent
+        # ~1500 tokens of history are kept so prompts stop growing per turn
+        self.memory = ConversationTokenBufferMemory(
+            llm=condense_question_llm,
+            max_token_limit=1500,
             memory_key="chat_history",
             return_messages=True,
             output_key="answer"
         )
         
+        # Cache search results for repeated queries in front of Qdrant
+        self.retriever = CachingRetriever(
+            retriever=QdrantQueryRetriever(
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding=self.embedding_model,
+                k=5
+            )
+        )
+        
         # Create QA chain
         self.qa_chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 5}),
+            condense_question_llm=condense_question_llm,
+            retriever=self.retriever,
             memory=self.memory,
             return_source_documents=True,
             chain_type="stuff"
         )
         
+        # Lighter chain for callers that don't display sources: MMR picks
+        # 5 diverse chunks out of 20 and no source documents are returned
+        self.qa_chain_without_sources = ConversationalRetrievalChain.from_llm(
+            llm=llm,
+            condense_question_llm=condense_question_llm,
+            retriever=self.vector_store.as_retriever(
+                search_type="mmr",
+                search_kwargs={"k": 5, "fetch_k": 20, "lambda_mult": 0.5}
+            ),
+            memory=self.memory,
+            return_source_documents=False,
+            chain_type="stuff"
+        )
+        
         print("✅ QA System initialized successfully!")
     
-    def ask_question(self, question):
+    def ask_question(self, question, callbacks=None, with_sources=True):
         """Ask a question and get response with sources"""
         if not self.qa_chain:
             self.initialize_qa_system()
         
-        result = self.qa_chain({
+        qa_chain = self.qa_chain if with_sources else self.qa_chain_without_sources
+        result = qa_chain({
             "question": f"Answer strictly based on the documents. If answer is not available, say 'Not found in context.'\n\n{question}"
-        })
+        }, callbacks=callbacks)
         
         # Extract answer and sources
         answer = result.get('answer', 'No answer generated')
         source_docs = result.get('source_documents', [])
         
         # Format sources - extract only document names
-        sources = []
-        for doc in source_docs:
-            source_path = doc.metadata.get('source', 'Unknown')
-            # Extract just the filename from the full path
-            if source_path != 'Unknown':
-                doc_name = os.path.basename(source_path)
-            else:
-                doc_name = 'Unknown'
-            
-            source_info = {
-                'source': doc_name,
+        # (basename('Unknown') is 'Unknown', so no special case is needed)
+        basename = os.path.basename
+        sources = [
+            {
+                'source': basename(doc.metadata.get('source', 'Unknown')),
                 'page': doc.metadata.get('page', 'N/A')
             }
-            sources.append(source_info)
+            for doc in source_docs
+        ]
         
         return {
             'answer': answer,
@@ -234,6 +528,33 @@ class RAGSystem:
             'question': question
         }
     
+    def stream_question(self, question):
+        """Ask a question and yield answer tokens as they are generated"""
+        if not self.qa_chain:
+            self.initialize_qa_system()
+        
+        handler = _TokenQueueHandler()
+        final = {}
+        
+        def run():
+            try:
+                final.update(self.ask_question(question, callbacks=[handler]))
+            except Exception as e:
+                final['error'] = str(e)
+            finally:
+                handler.tokens.put(None)
+        
+        threading.Thread(target=run, daemon=True).start()
+        
+        # Yield {'token': ...} events, then the full result with sources
+        while True:
+            token = handler.tokens.get()
+            if token is None:
+                break
+            yield {'token': token}
+        
+        yield final
+    
     def clear_conversation(self):
         """Clear conversation memory"""
         if self.memory:
@@ -255,16 +576,24 @@ class RAGSystem:
             print(f"  - {os.path.basename(file_path)}")
         
         print("\nStep 1: Loading documents...")
-        documents = self.load_documents_from_files(selected_files)
+        # Files chunked by an earlier run skip both loading and chunking
+        cache_paths = {
+            file_path: _chunk_cache_path(file_path, CHUNK_SIZE, CHUNK_OVERLAP)
+            for file_path in selected_files
+        }
+        cached_chunks, uncached_files = self.load_cached_chunks(cache_paths)
+        documents = self.load_documents_from_files(uncached_files)
         
-        if not documents:
+        if not documents and not cached_chunks:
             print("No documents were loaded successfully.")
             return False
         
         print(f"Loaded {len(documents)} document(s)")
         
         print("\nStep 2: Chunking documents...")
-        chunks = self.chunk_documents(documents)
+        chunks = self.chunk_documents(documents, CHUNK_SIZE, CHUNK_OVERLAP)
+        self.cache_chunks(chunks, cache_paths)
+        chunks.extend(cached_chunks)
         print(f"Created {len(chunks)} chunks")
         
         print("\nStep 3: Connecting to Qdrant...")
@@ -1,5 +1,6 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
+import json
 import os
 import threading
 import subprocess
@@ -37,14 +38,39 @@ def ask_question():
         if rag_system is None:
             return jsonify({'error': 'RAG system not initialized'}), 500
         
+        # ?with_sources=false skips returning and serializing source documents
+        with_sources = request.args.get('with_sources', 'true').lower() != 'false'
+        
         # Get response from RAG system
-        result = rag_system.ask_question(question)
+        result = rag_system.ask_question(question, with_sources=with_sources)
         
         return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ask/stream', methods=['POST'])
+def ask_question_stream():
+    try:
+        data = request.get_json()
+        question = data.get('question', '').strip()
+        
+        if not question:
+            return jsonify({'error': 'Question is required'}), 400
+        
+        if rag_system is None:
+            return jsonify({'error': 'RAG system not initialized'}), 500
+        
+        # Server-sent events: one per answer token, then the full result
+        def generate():
+            for event in rag_system.stream_question(question):
+                yield f"data: {json.dumps(event)}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/clear', methods=['POST'])
 def clear_conversation():
     try:
@@ -56,11 +82,13 @@ def clear_conversation():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_documents():
+    if rag_system is None:
+        return jsonify({'error': 'RAG system not initialized'}), 500
+    
     def run_indexing():
         try:
-            # Create a new RAG system instance for indexing
-            indexing_rag = RAGSystem()
-            success = indexing_rag.run_indexing_workflow()
+            # Reuse the global RAG system and its Qdrant/embedding clients
+            success = rag_system.run_indexing_workflow()
             if success:
                 print('✅ Document indexing completed successfully!')
             else:
@@ -2,10 +2,10 @@ import os
 from dotenv import load_dotenv
 from langchain_community.chat_models import ChatOpenAI
 from langchain_qdrant import QdrantVectorStore
-from langchain_nomic import NomicEmbeddings
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from qdrant_client import QdrantClient
+from langchain.memory import ConversationTokenBufferMemory
+from embeddings import embedding_backend
+from RAG import get_qdrant_client, get_shared_embedding_model
 
 # === Step 1: Load Environment Variables ===
 def load_api_keys():
@@ -14,15 +14,13 @@ def load_api_keys():
 
 # === Step 2: Connect to Qdrant ===
 def connect_to_qdrant(collection_name):
-    client = QdrantClient(url="http://localhost:6333")
     nomic_api_key = os.getenv("NOMIC_API_KEY")
-    if not nomic_api_key:
+    if not nomic_api_key and embedding_backend() != "local":
         raise ValueError("NOMIC_API_KEY not found in environment variables. Please check your .env file.")
     
-    embedding_model = NomicEmbeddings(
-        model="nomic-embed-text-v1.5",
-        nomic_api_key=nomic_api_key
-    )
+    # Same client and embedding model RAGSystem uses, not a second copy
+    client = get_qdrant_client()
+    embedding_model = get_shared_embedding_model(nomic_api_key)
 
     vector_store = QdrantVectorStore(
         client=client,
@@ -40,7 +38,9 @@ def create_qa_chain(vector_store, openai_key):
         temperature=0
     )
 
-    memory = ConversationBufferMemory(
+    memory = ConversationTokenBufferMemory(
+        llm=llm,
+        max_token_limit=1500,
         memory_key="chat_history",
         return_messages=True
     )
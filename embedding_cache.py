@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+try:
+    import zstandard as zstd
+except ImportError:  # Listed in requirements.txt; without it rows are stored raw
+    zstd = None
+
+EMBEDDING_CACHE_PATH = "embedding_cache.sqlite"
+
+# Keep each IN (...) lookup under SQLite's bound-parameter limit
+_LOOKUP_BATCH_SIZE = 500
+
+# Frame header of every zstd blob; rows without it are raw float32 bytes
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZSTD_LEVEL = 3
+
+# zstd (de)compressors aren't safe to share between threads; keep one of each per thread
+_zstd_local = threading.local()
+
+def _compressor():
+    if not hasattr(_zstd_local, "compressor"):
+        _zstd_local.compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    return _zstd_local.compressor
+
+def _decompressor():
+    if not hasattr(_zstd_local, "decompressor"):
+        _zstd_local.decompressor = zstd.ZstdDecompressor()
+    return _zstd_local.decompressor
+
+def _encode(vector, compressor):
+    """Pack a vector as float32 bytes, zstd-compressed when a compressor is given"""
+    raw = np.asarray(vector, dtype=np.float32).tobytes()
+    if compressor is None:
+        return raw
+    return compressor.compress(raw)
+
+def _decode(blob, decompressor):
+    """Unpack a cached blob, whether it was stored compressed or raw"""
+    if blob[:4] == ZSTD_MAGIC:
+        if decompressor is None:
+            raise RuntimeError("Embedding cache holds zstd-compressed rows; install zstandard to read them")
+        blob = decompressor.decompress(blob)
+    return np.frombuffer(blob, dtype=np.float32).tolist()
+
+class EmbeddingCache:
+    """SQLite store of document embeddings keyed by (sha256 of text, model)"""
+    
+    def __init__(self, model, path=EMBEDDING_CACHE_PATH):
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "hash TEXT, model TEXT, vec BLOB, PRIMARY KEY (hash, model))"
+        )
+        self._conn.commit()
+    
+    def close(self):
+        """Close the SQLite connection"""
+        with self._lock:
+            self._conn.close()
+    
+    def lookup(self, hashes):
+        """Return a {hash: vector} dict for the hashes that are cached"""
+        found = {}
+        decompressor = _decompressor() if zstd else None
+        
+        with self._lock:
+            for i in range(0, len(hashes), _LOOKUP_BATCH_SIZE):
+                batch = hashes[i:i + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM cache WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model, *batch]
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = _decode(blob, decompressor)
+        
+        return found
+    
+    def store(self, hashes, vectors):
+        """Write freshly computed vectors back to the cache"""
+        compressor = _compressor() if zstd else None
+        rows = [
+            (text_hash, self.model, _encode(vector, compressor))
+            for text_hash, vector in zip(hashes, vectors)
+        ]
+        
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO cache VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+    
+    def _split_cached(self, texts):
+        """Hash texts and return (hashes, cached vectors, indices of misses)"""
+        hashes = [hashlib.sha256(text.encode()).hexdigest() for text in texts]
+        vectors = self.lookup(hashes)
+        missing = [i for i, text_hash in enumerate(hashes) if text_hash not in vectors]
+        return hashes, vectors, missing
+    
+    def _merge_fresh(self, hashes, vectors, missing, fresh):
+        """Store freshly embedded vectors and return all vectors in input order"""
+        if missing:
+            self.store([hashes[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[hashes[i]] = vector
+        
+        return [vectors[text_hash] for text_hash in hashes]
+    
+    def embed(self, texts, embed_fn):
+        """Return vectors for texts, calling embed_fn only for cache misses"""
+        hashes, vectors, missing = self._split_cached(texts)
+        fresh = embed_fn([texts[i] for i in missing]) if missing else []
+        return self._merge_fresh(hashes, vectors, missing, fresh)
+    
+    async def aembed(self, texts, aembed_fn):
+        """Async embed(): awaits aembed_fn only for cache misses"""
+        hashes, vectors, missing = self._split_cached(texts)
+        fresh = await aembed_fn([texts[i] for i in missing]) if missing else []
+        return self._merge_fresh(hashes, vectors, missing, fresh)
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import httpx
+from langchain_core.embeddings import Embeddings
+from langchain_nomic import NomicEmbeddings
+
+NOMIC_MODEL = "nomic-embed-text-v1.5"
+LOCAL_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+NOMIC_EMBED_URL = "https://api-atlas.nomic.ai/v1/embedding/text"
+
+# Rate limits and server errors are retried with exponential backoff
+NOMIC_MAX_RETRIES = 5
+NOMIC_BACKOFF_SECONDS = 1.0
+
+# Exported INT8 OpenVINO models (one subdirectory per model) and the
+# compiled-blob cache, reused across processes
+OV_MODEL_DIR = "./ov_model"
+OV_CACHE_DIR = "./ov_cache"
+
+class CachedEmbeddings(NomicEmbeddings):
+    """Nomic embeddings with an LRU cache in front of embed_query"""
+    
+    def __init__(self, *args, cache_size=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._query_cache = OrderedDict()
+        self._query_cache_size = cache_size
+        self._query_cache_lock = threading.Lock()
+    
+    def embed_query(self, text):
+        """Embed a query, reusing the vector if the same text was seen before"""
+        key = hashlib.blake2b(text.encode()).digest()
+        
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                return vector
+        
+        # Cache miss - one round-trip to the embedding API
+        vector = super().embed_query(text)
+        
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+        
+        return vector
+
+class PooledNomicEmbeddings(Embeddings):
+    """Nomic API embeddings sent over persistent, pooled HTTP/2 connections"""
+    
+    def __init__(self, nomic_api_key, model=NOMIC_MODEL, timeout=60):
+        self.model = model
+        
+        # One sync and one async client, reused for every batch so the TLS
+        # handshake is paid once and concurrent batches share connections
+        client_options = dict(
+            http2=True,
+            headers={"Authorization": f"Bearer {nomic_api_key}"},
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            timeout=timeout,
+            trust_env=False
+        )
+        self._client = httpx.Client(**client_options)
+        self._async_client = httpx.AsyncClient(**client_options)
+    
+    def _payload(self, texts, task_type):
+        return {"model": self.model, "texts": texts, "task_type": task_type}
+    
+    def _retry_delay(self, attempt, response=None):
+        """Return how long to wait before retrying, or None to give up"""
+        if attempt >= NOMIC_MAX_RETRIES:
+            return None
+        if response is not None:
+            if response.status_code != 429 and response.status_code < 500:
+                return None
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return float(retry_after)
+        return NOMIC_BACKOFF_SECONDS * 2 ** attempt
+    
+    def _post(self, payload):
+        """POST to the embedding API, retrying on 429, 5xx and dropped connections"""
+        attempt = 0
+        while True:
+            try:
+                response = self._client.post(NOMIC_EMBED_URL, json=payload)
+            except httpx.TransportError:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                if response.is_success:
+                    return response.json()["embeddings"]
+                delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    response.raise_for_status()
+            time.sleep(delay)
+            attempt += 1
+    
+    async def _apost(self, payload):
+        """Async _post()"""
+        attempt = 0
+        while True:
+            try:
+                response = await self._async_client.post(NOMIC_EMBED_URL, json=payload)
+            except httpx.TransportError:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                if response.is_success:
+                    return response.json()["embeddings"]
+                delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    response.raise_for_status()
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    def embed_documents(self, texts):
+        return self._post(self._payload(texts, "search_document"))
+    
+    def embed_query(self, text):
+        return self._post(self._payload([text], "search_query"))[0]
+    
+    async def aembed_documents(self, texts):
+        return await self._apost(self._payload(texts, "search_document"))
+    
+    async def aembed_query(self, text):
+        return (await self._apost(self._payload([text], "search_query")))[0]
+    
+    def close(self):
+        """Close the pooled sync connections"""
+        self._client.close()
+    
+    async def aclose(self):
+        """Close the pooled async connections (from the loop that used them)"""
+        await self._async_client.aclose()
+
+class OptimumIntelEmbeddings(Embeddings):
+    """INT8-quantized Nomic model running locally on CPU through OpenVINO"""
+    
+    def __init__(self, model=LOCAL_MODEL, batch_size=32, max_length=512):
+        # Optional dependencies, only needed for EMBED_BACKEND=local
+        import torch
+        from optimum.intel.openvino import OVModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        self._torch = torch
+        self.model = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model, trust_remote_code=True)
+        
+        # Export and quantize once; later processes load the saved IR, whose
+        # weights OpenVINO memory-maps so every worker shares one copy
+        model_dir = os.path.join(OV_MODEL_DIR, model.replace("/", "--"))
+        exported = os.path.isdir(model_dir)
+        self.ov_model = OVModelForFeatureExtraction.from_pretrained(
+            model_dir if exported else model,
+            export=not exported,
+            load_in_8bit=not exported,
+            trust_remote_code=True,
+            ov_config={"CACHE_DIR": OV_CACHE_DIR}
+        )
+        if not exported:
+            self._save_export(model_dir)
+    
+    def _save_export(self, model_dir):
+        """Save the exported model, renaming it into place only once complete"""
+        os.makedirs(OV_MODEL_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=OV_MODEL_DIR, prefix=".export-")
+        try:
+            self.ov_model.save_pretrained(tmp_dir)
+            os.replace(tmp_dir, model_dir)
+        except OSError:
+            # Another process finished exporting first; keep its copy
+            if not os.path.isdir(model_dir):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    def _embed(self, texts):
+        """Embed already-prefixed texts in batches"""
+        torch = self._torch
+        vectors = []
+        
+        for i in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[i:i + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt"
+            )
+            
+            with torch.inference_mode():
+                hidden = self.ov_model(**inputs).last_hidden_state
+                
+                # Mean-pool over real tokens, then L2-normalize
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            
+            vectors.extend(pooled.tolist())
+        
+        return vectors
+    
+    def embed_documents(self, texts):
+        # Nomic models expect a task prefix on every input
+        return self._embed([f"search_document: {text}" for text in texts])
+    
+    def embed_query(self, text):
+        return self._embed([f"search_query: {text}"])[0]
+
+def embedding_backend():
+    """Return the embedding backend selected by EMBED_BACKEND (nomic or local)"""
+    return os.getenv("EMBED_BACKEND", "nomic").lower()
+
+def get_embedding_model(nomic_api_key=None):
+    """Create the embedding model for the configured backend"""
+    if embedding_backend() == "local":
+        return OptimumIntelEmbeddings()
+    
+    return CachedEmbeddings(
+        model=NOMIC_MODEL,
+        nomic_api_key=nomic_api_key
+    )
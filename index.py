@@ -1,22 +1,53 @@
+import asyncio
+import mmap
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_nomic import NomicEmbeddings
+from langchain_community.document_loaders import PyMuPDFLoader, PyPDFLoader
+from langchain_core.documents import Document
 from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
-from uuid import uuid4
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import (
+    Distance,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    PayloadSchemaType,
+    PointStruct,
+    VectorParams
+)
+from text_splitter import split_documents
+from embedding_cache import EmbeddingCache
+from embeddings import PooledNomicEmbeddings
+from qdrant_collection import INDEXING_THRESHOLD, VECTOR_SIZE, chunk_id, create_documents_collection
 
 # Load environment variables
 load_dotenv()
 
+# Qdrant gRPC endpoint shared by the sync and async clients
+QDRANT_HOST = "localhost"  # Change this if using cloud Qdrant
+QDRANT_GRPC_PORT = 6334
+
+# Text files larger than this are loaded as ~1 MB line-aligned blocks
+LARGE_TEXT_FILE_SIZE = 10 * 1024 * 1024
+TEXT_BLOCK_SIZE = 1024 * 1024
+
+# Query-level semantic cache collection, created next to the main one with
+# an integer "signature" payload index for LSH bucket filtering
+LSH_CACHE_COLLECTION = "bank_documents_lsh_cache"
+
+# TXT reads are I/O bound, so many of them can overlap on threads
+TEXT_READ_WORKERS = 16
+
 
 # === Step 1: Select and Load Files ===
 def select_files():
     """Use tkinter file dialog to select PDF and TXT files"""
+    # Imported here so loader worker processes never pull in GUI state
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+    
     root = tk.Tk()
     root.withdraw()  # Hide the main window
     
@@ -41,44 +72,94 @@ def select_files():
     
     return list(selected_files)
 
-def load_documents_from_files(file_paths):
-    """Load documents from selected file paths"""
-    all_docs = []
+def _load_text(file_path):
+    """Read a text file through mmap instead of copying it with read()"""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Decode straight from the mapped pages; slicing mm would first
+            # copy the bytes into a Python object, just like read() does
+            if len(mm) <= LARGE_TEXT_FILE_SIZE:
+                text = str(mm, "utf-8", "replace")
+                return [Document(page_content=text, metadata={"source": file_path})]
+
+            # Large files become several documents, each cut after a newline
+            documents = []
+            start = 0
+            with memoryview(mm) as view:
+                while start < len(mm):
+                    end = min(start + TEXT_BLOCK_SIZE, len(mm))
+                    if end < len(mm):
+                        newline = mm.rfind(b"\n", start, end)
+                        if newline > start:
+                            end = newline + 1
+
+                    text = str(view[start:end], "utf-8", "replace")
+                    documents.append(Document(page_content=text, metadata={"source": file_path}))
+                    start = end
+
+            return documents
+
+def _load_one(file_path):
+    """Load a single PDF or TXT file into a list of documents"""
+    file_name = os.path.basename(file_path)
     
-    for file_path in file_paths:
-        file_name = os.path.basename(file_path)
-        
-        if file_name.lower().endswith(".pdf"):
-            print(f"Loading PDF: {file_name}")
+    if file_name.lower().endswith(".pdf"):
+        print(f"Loading PDF: {file_name}")
+        try:
             try:
+                # PyMuPDF (MuPDF, native code) extracts text far faster than pypdf
+                return list(PyMuPDFLoader(file_path).lazy_load())
+            except ImportError:
                 loader = PyPDFLoader(file_path)
-                pages = loader.load_and_split()
-                all_docs.extend(pages)
-            except Exception as e:
-                print(f"Error loading PDF {file_name}: {e}")
-                
-        elif file_name.lower().endswith(".txt"):
-            print(f"Loading TXT: {file_name}")
-            try:
-                loader = TextLoader(file_path, encoding='utf-8')
-                documents = loader.load()
-                all_docs.extend(documents)
-            except Exception as e:
-                print(f"Error loading TXT {file_name}: {e}")
-        else:
-            print(f"Skipping unsupported file: {file_name}")
+                # One page per document; chunk_documents does the only split
+                return loader.load()
+        except Exception as e:
+            print(f"Error loading PDF {file_name}: {e}")
+            
+    elif file_name.lower().endswith(".txt"):
+        print(f"Loading TXT: {file_name}")
+        try:
+            return _load_text(file_path)
+        except Exception as e:
+            print(f"Error loading TXT {file_name}: {e}")
+    else:
+        print(f"Skipping unsupported file: {file_name}")
     
-    return all_docs
+    return []
+
+def iter_documents(file_paths):
+    """Yield documents file by file, in the order the files were given"""
+    # PDF parsing is CPU bound and goes to worker processes; returns diminish
+    # past ~4 workers because of PyMuPDF's internal locking. TXT files are
+    # read on threads so their text isn't pickled back from another process
+    pdf_workers = min(os.cpu_count() or 1, 4)
+    
+    # Only enough files to keep every worker busy are loaded ahead of the
+    # consumer; the next file is submitted as each loaded one is taken, so
+    # a slow embedding step never lets parsed pages pile up in memory
+    window = pdf_workers + TEXT_READ_WORKERS
+    
+    with ProcessPoolExecutor(max_workers=pdf_workers) as processes, \
+            ThreadPoolExecutor(max_workers=TEXT_READ_WORKERS) as threads:
+        def submit(file_path):
+            executor = threads if file_path.lower().endswith(".txt") else processes
+            return executor.submit(_load_one, file_path)
+        
+        file_paths = iter(file_paths)
+        pending = deque(submit(file_path) for file_path in islice(file_paths, window))
+        while pending:
+            documents = pending.popleft().result()
+            next_path = next(file_paths, None)
+            if next_path is not None:
+                pending.append(submit(next_path))
+            yield from documents
 
 # === Step 2: Chunk the Documents ===
 def chunk_documents(documents, chunk_size=500, chunk_overlap=50):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=["\n\n", "\n", ".", " "]
-    )
-
-    chunks = splitter.split_documents(documents)
+    chunks = split_documents(documents, chunk_size, chunk_overlap)
     return chunks
 
 # === Step 3: Initialize Embedding Model ===
@@ -87,60 +168,181 @@ def get_nomic_embedding_model():
     if not nomic_api_key:
         raise ValueError("NOMIC_API_KEY not found in environment variables. Please check your .env file.")
     
-    return NomicEmbeddings(
+    return PooledNomicEmbeddings(
         model="nomic-embed-text-v1.5",
         nomic_api_key=nomic_api_key
     )
 
+def check_embedding_model(embedding_model):
+    """Embed one short text so a bad API key fails before any file is parsed"""
+    try:
+        embedding_model.embed_documents(["healthcheck"])
+    except Exception as e:
+        raise RuntimeError(f"Embedding model check failed, verify NOMIC_API_KEY: {e}") from e
+
 # === Step 4: Connect to Qdrant DB ===
-def connect_qdrant():
+def connect_qdrant(bulk_mode=False):
+    # gRPC (protobuf over HTTP/2) instead of REST/JSON for vector uploads
     client = QdrantClient(
-        url="http://localhost:6333"  # Change this if using cloud Qdrant
+        host=QDRANT_HOST,
+        grpc_port=QDRANT_GRPC_PORT,
+        prefer_grpc=True
     )
 
     collection_name = "bank_documents"
 
+    # Fail fast on an unreachable server before any documents are parsed
+    try:
+        client.get_collections()
+    except Exception as e:
+        raise RuntimeError(f"Could not reach Qdrant on {QDRANT_HOST}:{QDRANT_GRPC_PORT}: {e}") from e
+
+    # In bulk mode the HNSW graph isn't updated point by point during the
+    # upload; finish_bulk_load() re-enables indexing for one build at the end
+    bulk_optimizers = OptimizersConfigDiff(indexing_threshold=0) if bulk_mode else None
+
     # Create collection if it doesn't exist
     try:
         client.get_collection(collection_name)
         print(f"Collection '{collection_name}' already exists.")
     except Exception:
         print(f"Creating collection '{collection_name}'...")
+        create_documents_collection(client, collection_name, optimizers_config=bulk_optimizers)
+    else:
+        if bulk_mode:
+            client.update_collection(
+                collection_name=collection_name,
+                optimizers_config=bulk_optimizers
+            )
+
+    connect_lsh_cache(client)
+
+    return client, collection_name
+
+def connect_lsh_cache(client):
+    """Create the semantic query cache collection next to the main one"""
+    try:
+        client.get_collection(LSH_CACHE_COLLECTION)
+    except Exception:
+        print(f"Creating collection '{LSH_CACHE_COLLECTION}'...")
         client.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(size=768, distance=Distance.COSINE)
+            collection_name=LSH_CACHE_COLLECTION,
+            vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
+            # High-recall graph: a cache miss that should have been a hit
+            # costs a full retrieval + LLM call
+            hnsw_config=HnswConfigDiff(m=32, ef_construct=200)
+        )
+        client.create_payload_index(
+            collection_name=LSH_CACHE_COLLECTION,
+            field_name="signature",
+            field_schema=PayloadSchemaType.INTEGER
         )
 
-    return client, collection_name
+def finish_bulk_load(client, collection_name):
+    """Re-enable indexing after a bulk upload so the HNSW graph is built once"""
+    client.update_collection(
+        collection_name=collection_name,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+    )
 
 # === Step 5: Index and Store Chunks in Qdrant ===
-def index_documents(chunks, embedding_model, qdrant_client, collection_name):
-    texts = []
-    metadatas = []
-
+def iter_chunks(chunks):
+    """Yield (text, source, page, chunk_id) tuples one chunk at a time"""
     for chunk in chunks:
-        texts.append(chunk.page_content)
+        yield (
+            chunk.page_content,
+            chunk.metadata.get("source", ""),
+            chunk.metadata.get("page", -1),
+            chunk_id(chunk.page_content)
+        )
 
-        metadata = {
-            "source": chunk.metadata.get("source", ""),
-            "page": chunk.metadata.get("page", -1),
-            "chunk_id": str(uuid4())
-        }
+def iter_batches(items, batch_size):
+    """Yield lists of up to batch_size items from any iterable"""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
 
-        metadatas.append(metadata)
+async def index_documents(chunks, embedding_model, collection_name, batch_size=64, max_concurrency=8):
+    print("Generating embeddings and uploading to Qdrant...")
+    # Chunks embedded by an earlier run are read back instead of re-embedded
+    cache = EmbeddingCache(embedding_model.model)
+    aclient = AsyncQdrantClient(host=QDRANT_HOST, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = []
+    indexed = 0
 
-    print("Generating embeddings...")
-    embeddings = embedding_model.embed_documents(texts)
+    async def index_batch(batch):
+        """Embed one batch (cache misses only) and upsert its points"""
+        try:
+            texts = [text for text, _, _, _ in batch]
+            vectors = await cache.aembed(texts, embedding_model.aembed_documents)
 
-    print("Uploading to Qdrant...")
-    qdrant = QdrantVectorStore(
-        client=qdrant_client,
-        collection_name=collection_name,
-        embedding=embedding_model
-    )
+            # Upload the precomputed vectors directly; QdrantVectorStore.add_texts
+            # would embed every text a second time
+            # Metadata dicts are only built here, for the batch being uploaded
+            points = [
+                PointStruct(
+                    id=point_id,
+                    vector=vector,
+                    payload={
+                        QdrantVectorStore.CONTENT_KEY: text,
+                        QdrantVectorStore.METADATA_KEY: {"source": source, "page": page, "chunk_id": point_id}
+                    }
+                )
+                for (text, source, page, point_id), vector in zip(batch, vectors)
+            ]
+
+            await aclient.upsert(collection_name=collection_name, points=points, wait=False)
+        finally:
+            semaphore.release()
+
+    def raise_failed():
+        """Re-raise the first error of a finished batch, then forget done batches"""
+        for task in tasks:
+            if task.done() and task.exception():
+                raise task.exception()
+        tasks[:] = [task for task in tasks if not task.done()]
+
+    try:
+        # Stream batches through embed -> upsert so only the batches in
+        # flight and iter_documents' bounded read-ahead are held in memory
+        batches = iter_batches(iter_chunks(chunks), batch_size)
+        while True:
+            # Advancing the generator may load and chunk files; do it in a
+            # thread so the in-flight batches keep progressing meanwhile
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
 
-    qdrant.add_texts(texts=texts, metadatas=metadatas)
-    print(f"✅ Indexed {len(texts)} chunks into Qdrant.")
+            # Up to max_concurrency batches embed and upload at the same time;
+            # a failed batch (bad key, exhausted retries) stops the whole run
+            await semaphore.acquire()
+            raise_failed()
+            tasks.append(asyncio.create_task(index_batch(batch)))
+            indexed += len(batch)
+
+        await asyncio.gather(*tasks)
+    finally:
+        # Cancel batches still in flight and wait for them to unwind before
+        # the client is closed underneath them
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await aclient.close()
+        cache.close()
+
+    print(f"✅ Indexed {indexed} chunks into Qdrant.")
+    return indexed
+
+async def index_and_close(chunks, embedding_model, collection_name):
+    """Run index_documents, then close the model's async connections in the same loop"""
+    try:
+        return await index_documents(chunks, embedding_model, collection_name)
+    finally:
+        await embedding_model.aclose()
 
 # === Main Entry Point ===
 def main():
@@ -156,27 +358,36 @@ def main():
     for file_path in selected_files:
         print(f"  - {os.path.basename(file_path)}")
     
-    print("\nStep 1: Loading documents...")
-    documents = load_documents_from_files(selected_files)
-    
-    if not documents:
-        print("No documents were loaded successfully. Exiting...")
-        return
-    
-    print(f"Loaded {len(documents)} document(s)")
+    # Check both services up front so a missing key or a stopped Qdrant
+    # fails before minutes of PDF parsing are spent and thrown away
+    print("\nStep 1: Initializing embedding model...")
+    embedding_model = get_nomic_embedding_model()
 
-    print("\nStep 2: Chunking documents...")
-    chunks = chunk_documents(documents)
-    print(f"Created {len(chunks)} chunks")
+    try:
+        check_embedding_model(embedding_model)
 
-    print("\nStep 3: Connecting to Qdrant...")
-    qdrant_client, collection_name = connect_qdrant()
+        print("\nStep 2: Connecting to Qdrant...")
+        qdrant_client, collection_name = connect_qdrant(bulk_mode=True)
 
-    print("\nStep 4: Initializing embedding model...")
-    embedding_model = get_nomic_embedding_model()
+        try:
+            # Load, chunk and index as one lazy pipeline: files are loaded a
+            # bounded window ahead, each page is chunked as it's consumed and its
+            # chunks stream straight into the uploader
+            print("\nStep 3: Loading, chunking and indexing documents...")
+            chunks = (
+                chunk
+                for document in iter_documents(selected_files)
+                for chunk in chunk_documents([document])
+            )
+            indexed = asyncio.run(index_and_close(chunks, embedding_model, collection_name))
+        finally:
+            finish_bulk_load(qdrant_client, collection_name)
+    finally:
+        embedding_model.close()
 
-    print("\nStep 5: Indexing documents...")
-    index_documents(chunks, embedding_model, qdrant_client, collection_name)
+    if not indexed:
+        print("No documents were loaded successfully. Exiting...")
+        return
     
     print("\n✅ Document indexing completed successfully!")
 
@@ -0,0 +1,52 @@
+import hashlib
+from uuid import UUID, uuid5
+from qdrant_client.http.models import (
+    Distance,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams
+)
+
+# Point ids are derived from chunk content, so re-indexing the same text from
+# RAG.py or index.py overwrites its point instead of adding a duplicate
+CHUNK_ID_NAMESPACE = UUID("6ba7b810-9dad-11d1-80b4-00c04fd430c8")
+
+# Nomic nomic-embed-text-v1.5 vector size
+VECTOR_SIZE = 768
+
+# Segments holding less than this many KB of vectors are searched by brute
+# force instead of HNSW. It's a size, not a point count: 20000 KB is ~6.5k
+# float32 768-d vectors. index.py sets it to 0 during a bulk load to skip
+# indexing entirely and restores this value afterwards
+INDEXING_THRESHOLD = 20000
+
+def create_documents_collection(client, collection_name, optimizers_config=None):
+    """Create the document collection with the settings RAG.py and index.py share"""
+    client.create_collection(
+        collection_name=collection_name,
+        # Qdrant L2-normalizes cosine vectors on upload and scores them with
+        # a plain dot product, so DOT would gain nothing. Full float32 vectors
+        # live on disk and are only read back for rescoring
+        vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE, on_disk=True),
+        # Keep an int8 copy of every vector in RAM (4x smaller) for the HNSW search
+        quantization_config=ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True
+            )
+        ),
+        # Denser graph than the defaults (the retriever's hnsw_ef=128 is
+        # tuned for it), kept in RAM so traversal doesn't wait on disk reads
+        hnsw_config=HnswConfigDiff(m=32, ef_construct=256, on_disk=False),
+        on_disk_payload=True,
+        optimizers_config=optimizers_config or OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+    )
+
+def chunk_id(text):
+    """Return the deterministic Qdrant point id for a chunk's text"""
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    return str(uuid5(CHUNK_ID_NAMESPACE, digest))
@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_qdrant import QdrantVectorStore
+from pydantic import PrivateAttr
+from qdrant_client.http.models import Prefetch, QuantizationSearchParams, SearchParams
+
+class QdrantQueryRetriever(BaseRetriever):
+    """Retriever that searches Qdrant through the Query API with a prefetch stage"""
+    
+    client: Any
+    collection_name: str
+    embedding: Any
+    k: int = 5
+    prefetch_limit: int = 50
+    hnsw_ef: int = 128
+    
+    def search_by_vector(self, vector) -> List[Document]:
+        """Return the top k documents for an already embedded query"""
+        # Stage 1: HNSW traversal over the in-RAM int8 vectors only, pulling
+        # a wide candidate set without touching the full-precision vectors.
+        # Stage 2: re-rank just those candidates with the float32 originals.
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            prefetch=[
+                Prefetch(
+                    query=vector,
+                    limit=self.prefetch_limit,
+                    params=SearchParams(
+                        hnsw_ef=self.hnsw_ef,
+                        quantization=QuantizationSearchParams(
+                            ignore=False,
+                            rescore=False
+                        )
+                    )
+                )
+            ],
+            query=vector,
+            limit=self.k,
+            search_params=SearchParams(
+                quantization=QuantizationSearchParams(rescore=True)
+            ),
+            with_payload=True
+        )
+        
+        return [_to_document(point) for point in response.points]
+    
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector = self.embedding.embed_query(query)
+        return self.search_by_vector(vector)
+
+class CachingRetriever(BaseRetriever):
+    """LRU cache of search results, keyed by query vector, in front of Qdrant"""
+    
+    retriever: QdrantQueryRetriever
+    cache_size: int = 10_000
+    # Optional cosine distance under which a cached query counts as a hit
+    spatial_threshold: Optional[float] = None
+    # Seconds a result stays valid; index.py writes to the collection from
+    # another process, where clear() can't reach this cache
+    ttl: Optional[float] = 300.0
+    
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    
+    def clear(self):
+        """Drop all cached results, e.g. after new documents were indexed"""
+        with self._lock:
+            self._cache.clear()
+    
+    def _lookup(self, key, unit_vector):
+        """Return cached documents for an exact or (optionally) nearby query"""
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        
+        if entry is not None and entry[2] <= now:
+            # Expired - drop it so the query goes back to Qdrant
+            del self._cache[key]
+            entry = None
+        
+        if entry is None and self.spatial_threshold is not None:
+            # Cached vectors are L2-normalized, so cosine similarity is a dot product
+            for cached_key, (cached_vector, _, expires_at) in self._cache.items():
+                if expires_at > now and 1.0 - np.dot(unit_vector, cached_vector) < self.spatial_threshold:
+                    key, entry = cached_key, self._cache[cached_key]
+                    break
+        
+        if entry is None:
+            return None
+        
+        self._cache.move_to_end(key)
+        return entry[1]
+    
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector = np.asarray(self.retriever.embedding.embed_query(query), dtype=np.float32)
+        key = hashlib.blake2b(vector.tobytes()).digest()
+        
+        # Normalize once here instead of on every spatial comparison
+        unit_vector = vector / (np.linalg.norm(vector) or 1.0)
+        
+        with self._lock:
+            documents = self._lookup(key, unit_vector)
+        if documents is not None:
+            return list(documents)
+        
+        # Cache miss - go to Qdrant and remember the result
+        documents = self.retriever.search_by_vector(vector.tolist())
+        
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+            self._cache[key] = (unit_vector, documents, expires_at)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        
+        return list(documents)
+
+def _to_document(point):
+    """Convert a Qdrant point written by QdrantVectorStore into a Document"""
+    payload = point.payload or {}
+    return Document(
+        page_content=payload.get(QdrantVectorStore.CONTENT_KEY, ""),
+        metadata=payload.get(QdrantVectorStore.METADATA_KEY) or {}
+    )
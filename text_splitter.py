@@ -0,0 +1,73 @@
+import re
+from bisect import bisect_left, bisect_right
+from langchain_core.documents import Document
+
+# Separators in order of preference (same as the old RecursiveCharacterTextSplitter setup)
+SEPARATORS = ["\n\n", "\n", ".", " "]
+_SEPARATOR_PATTERN = re.compile("|".join(re.escape(separator) for separator in SEPARATORS))
+
+def _find_boundaries(text):
+    """Scan the text once and return the offsets just past every separator"""
+    by_separator = {separator: [] for separator in SEPARATORS}
+    all_boundaries = []
+    
+    for match in _SEPARATOR_PATTERN.finditer(text):
+        by_separator[match.group()].append(match.end())
+        all_boundaries.append(match.end())
+    
+    return [by_separator[separator] for separator in SEPARATORS], all_boundaries
+
+def split_text(text, chunk_size=500, chunk_overlap=50):
+    """Split text into chunks of at most chunk_size characters"""
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size}).")
+    
+    # Texts that already fit in one chunk (short pages, small files) skip
+    # the separator scan entirely
+    if len(text) <= chunk_size:
+        chunk = text.strip()
+        return [chunk] if chunk else []
+    
+    levels, all_boundaries = _find_boundaries(text)
+    chunks = []
+    start = 0
+    
+    while start < len(text):
+        end = start + chunk_size
+        
+        if end >= len(text):
+            end = len(text)
+        else:
+            # Cut after the most preferred separator inside the window; the
+            # chunk must outgrow the overlap so the next one moves forward
+            lowest = start + chunk_overlap + 1
+            for offsets in levels:
+                i = bisect_right(offsets, end) - 1
+                if i >= 0 and offsets[i] >= lowest:
+                    end = offsets[i]
+                    break
+        
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        
+        if end >= len(text):
+            break
+        
+        # Step back by the overlap, snapping to the next separator so the
+        # following chunk doesn't start mid-word
+        i = bisect_left(all_boundaries, end - chunk_overlap)
+        if i < len(all_boundaries) and all_boundaries[i] < end:
+            start = all_boundaries[i]
+        else:
+            start = end
+    
+    return chunks
+
+def split_documents(documents, chunk_size=500, chunk_overlap=50):
+    """Split documents into chunks, copying each document's metadata"""
+    return [
+        Document(page_content=chunk, metadata=dict(document.metadata))
+        for document in documents
+        for chunk in split_text(document.page_content, chunk_size, chunk_overlap)
+    ]